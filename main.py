@@ -1,46 +1,95 @@
-import speech_recognition as sr 
+import speech_recognition as sr
 import threading
 import time
+import asyncio
+import json
+import re
+import base64
+import hashlib
 from rich.console import Console
 from rich.panel import Panel
 from rich.text import Text
 from rich.layout import Layout
 from rich.live import Live
-from rich.spinner import Spinner
 import os
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor
-import requests
-import io
-from pydub import AudioSegment
-from pydub.playback import play
+import httpx
+import numpy as np
+import sounddevice as sd
+from websocket import create_connection
+from faster_whisper import WhisperModel
 from dotenv import load_dotenv
 
 load_dotenv()
 
 try:
-    from groq import Groq
+    from groq import Groq, AsyncGroq
     GROQ_AVAILABLE = True
 except ImportError:
     GROQ_AVAILABLE = False
 
+try:
+    from fastembed import TextEmbedding
+    FASTEMBED_AVAILABLE = True
+except ImportError:
+    FASTEMBED_AVAILABLE = False
+
 class LiveSpeechRecognition:
     def __init__(self, trigger_word: str = "bob", personality: str = "You're a nice guy called bob"): # Change the personality to whatever you want and the trigger word to whatever you want.
         self.recognizer = sr.Recognizer()
+        # Fixed threshold (calibrated once, see _calibrate_noise) and short
+        # pause windows so listen() returns soon after the user stops talking.
+        self.recognizer.dynamic_energy_threshold = False
+        self.recognizer.pause_threshold = 0.3
+        self.recognizer.non_speaking_duration = 0.2
         self.microphone = sr.Microphone()
+        self._stt = WhisperModel("base.en", device="cpu", compute_type="int8")
         self.is_listening = False
         self.console = Console()
         self.groq_client = None
+        self.groq_async = None
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
         self.trigger_word = trigger_word.lower()
+        self._trigger_re = re.compile(rf"\b{re.escape(self.trigger_word)}\b", re.IGNORECASE)
+        # Whisper transcripts are punctuated ("Stop."), so tolerate trailing punctuation.
+        self._stop_re = re.compile(r"^\s*stop[\s.!?]*$", re.IGNORECASE)
         self.personality = personality
+        # Built once and reused verbatim so the provider can prefix-cache the prompt.
+        self._system_msg = {"role": "system", "content": f"personality: {self.personality}"}
+        self.voice_id = "vO7hjeAjmsdlGgUdvPpe" # Change this to whatever voice you want.
+        self._sentence_re = re.compile(r".*?[.!?\n]+\s*", re.DOTALL)
         self.layout = Layout()
+        self._live = None
         self.thread_pool = ThreadPoolExecutor(max_workers=3)
         self.memory = []
+        self.memory_window = 12
+        self.memory_summary = ""
+        self._noise_profile_file = "noise_profile.txt"
+        self._tts_cache_dir = "tts_cache"
+        self._tts_cache_limit = 200 * 1024 * 1024
+        self._cache_file = "cache.npz"
+        self._cache_threshold = 0.92
+        self._embedder = None
+        self._cache_vecs = np.empty((0, 384), dtype=np.float32)
+        self._cache_entries = []
+        self._playback_stream = None
+        self._playback_lock = threading.Lock()
+        self._playback_closed = False
+        # Pooled client so each TTS call reuses one TCP+TLS connection.
+        self._http = httpx.Client(
+            http2=True,
+            timeout=30.0,
+            headers={"xi-api-key": os.getenv("ELEVENLABS_API_KEY")},
+        )
         self._initialize_layout()
         self._initialize_ai_client()
+        self._initialize_semantic_cache()
         self.is_processing = False
         self.stop_requested = False
-        self.transcription_history = []
-        self.error_log = []
+        self.transcription_history = deque(maxlen=10000)
+        self.error_log = deque(maxlen=10000)
 
     def _initialize_layout(self) -> None:
         self.layout.split(
@@ -52,18 +101,43 @@ class LiveSpeechRecognition:
             Layout(name="input", ratio=1),
             Layout(name="output", ratio=1)
         )
+        # Panels are built once and mutated in place on update, so streaming
+        # repaints don't allocate a fresh Panel/Text per refresh.
+        self._input_text = Text("", style="green")
+        self._input_panel = Panel(self._input_text, title="Input")
+        self._output_text = Text("", style="cyan")
+        self._output_panel = Panel(self._output_text, title="Output")
+        self._footer_text = Text("")
+        self._footer_panels = {}
+        self.layout["input"].update(self._input_panel)
+        self.layout["output"].update(self._output_panel)
 
     def _initialize_ai_client(self) -> None:
         if GROQ_AVAILABLE:
             try:
                 api_key = os.getenv("GROQ_API_KEY")
                 self.groq_client = Groq(api_key=api_key)
+                self.groq_async = AsyncGroq(api_key=api_key)
                 self.console.print("Groq client initialized successfully.", style="bold green")
             except Exception as e:
                 self._fallback_ai_init_error(e)
         else:
             self.console.print("Groq library not available. Running in echo mode.", style="yellow")
 
+    def _initialize_semantic_cache(self) -> None:
+        if not FASTEMBED_AVAILABLE:
+            self.console.print("fastembed library not available. Semantic response cache disabled.", style="yellow")
+            return
+        try:
+            self._embedder = TextEmbedding("sentence-transformers/all-MiniLM-L6-v2")
+            if os.path.exists(self._cache_file):
+                saved = np.load(self._cache_file)
+                self._cache_vecs = saved["vecs"].astype(np.float32)
+                self._cache_entries = list(zip(saved["prompts"].tolist(), saved["responses"].tolist()))
+        except Exception as e:
+            self._embedder = None
+            self.console.print(f"Error initializing semantic cache: {e}", style="bold red")
+
     def _fallback_ai_init_error(self, error: Exception) -> None:
         self.console.print(f"Error initializing Groq client: {error}", style="bold red")
         self.console.print("Falling back to echo mode. Set GROQ_API_KEY for AI features.", style="yellow")
@@ -75,77 +149,165 @@ class LiveSpeechRecognition:
     def stop_listening(self) -> None:
         self.is_listening = False
         self.stop_requested = True
+        self._save_semantic_cache()
+        # Abort without taking the playback lock — _play_pcm may hold it for
+        # the rest of a spoken reply, and shutdown should not wait for that.
+        self._playback_closed = True
+        stream = self._playback_stream
+        if stream is not None:
+            stream.abort()
+            stream.close()
+            self._playback_stream = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._http.close()
         self.console.print("Stopped listening.", style="bold green")
 
     def _listen_loop(self) -> None:
         with self.microphone as source:
-            self.recognizer.adjust_for_ambient_noise(source)
-
-        with Live(self.layout, refresh_per_second=4) as live:
-            while self.is_listening:
-                self._update_footer("Listening...")
-                try:
-                    audio = self._capture_audio(source)
-                    self._process_audio(audio, live)
-                except sr.WaitTimeoutError:
-                    self._update_footer("Listening timed out, continuing...", "yellow")
-                time.sleep(0.1)
-
-    def _capture_audio(self, source) -> sr.AudioData:
-        with self.microphone as source:
-            return self.recognizer.listen(source, timeout=5, phrase_time_limit=5)
+            self._calibrate_noise(source)
+            with Live(self.layout, auto_refresh=False) as live:
+                self._live = live
+                while self.is_listening:
+                    self._update_footer("Listening...")
+                    try:
+                        audio = self.recognizer.listen(source, timeout=5, phrase_time_limit=5)
+                        self._process_audio(audio)
+                    except sr.WaitTimeoutError:
+                        self._update_footer("Listening timed out, continuing...", "yellow")
+            self._live = None
 
-    def _process_audio(self, audio: sr.AudioData, live: Live) -> None:
+    def _calibrate_noise(self, source) -> None:
+        if os.path.exists(self._noise_profile_file):
+            try:
+                with open(self._noise_profile_file) as file:
+                    self.recognizer.energy_threshold = float(file.read())
+                return
+            except (OSError, ValueError):
+                pass
+        self.recognizer.adjust_for_ambient_noise(source, duration=0.5)
+        try:
+            with open(self._noise_profile_file, 'w') as file:
+                file.write(str(self.recognizer.energy_threshold))
+        except OSError as e:
+            self.error_log.append(f"Noise profile save error: {e}")
+
+    def _process_audio(self, audio: sr.AudioData) -> None:
         try:
-            text = self.recognizer.recognize_google(audio)
+            text = self._transcribe(audio)
+            if not text:
+                self._update_footer("Could not understand audio", "yellow")
+                return
             self._update_input(f"You said: {text}")
             self.transcription_history.append(text)
-            if text.lower() == "stop":
+            if self._stop_re.match(text):
                 self.stop_requested = True
                 self._update_footer("Stop requested. Finishing current process...", "yellow")
             elif not self.is_processing:
-                self._process_input(text, live)
-        except sr.UnknownValueError:
-            self._update_footer("Could not understand audio", "yellow")
-        except sr.RequestError as e:
-            self._update_footer(f"Request error: {e}", "red")
-            self.error_log.append(f"Request error: {e}")
-
-    def _process_input(self, user_input: str, live: Live) -> None:
-        if self.trigger_word in user_input.lower():
+                self._process_input(text)
+        except Exception as e:
+            self._update_footer(f"Transcription error: {e}", "red")
+            self.error_log.append(f"Transcription error: {e}")
+
+    def _transcribe(self, audio: sr.AudioData) -> str:
+        pcm = audio.get_raw_data(convert_rate=16000, convert_width=2)
+        samples = np.frombuffer(pcm, np.int16).astype(np.float32) / 32768.0
+        segments, _ = self._stt.transcribe(samples, vad_filter=True, beam_size=1)
+        return " ".join(segment.text.strip() for segment in segments).strip()
+
+    def _process_input(self, user_input: str) -> None:
+        if self._trigger_re.search(user_input):
             if self.groq_client:
+                query_vec = self._embed(user_input) if self._embedder else None
+                if query_vec is not None:
+                    cached = self._semantic_cache_lookup(query_vec)
+                    if cached is not None:
+                        self._update_output(cached, "AI Response (cached)")
+                        self._speak_async(cached)
+                        return
                 self.is_processing = True
-                self.thread_pool.submit(self._process_with_ai, user_input, live)
+                asyncio.run_coroutine_threadsafe(self._process_with_ai_async(user_input, query_vec), self._loop)
             else:
                 self._echo_response(user_input)
         else:
             self._update_footer(f"Trigger word '{self.trigger_word}' not detected.", "yellow")
 
-    def _process_with_ai(self, user_input: str, live: Live) -> None:
+    def _embed(self, text: str) -> np.ndarray:
+        vec = np.array(next(iter(self._embedder.embed([text]))), dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def _semantic_cache_lookup(self, query_vec: np.ndarray):
+        if not self._cache_entries:
+            return None
+        sims = self._cache_vecs @ query_vec
+        best = int(np.argmax(sims))
+        if sims[best] > self._cache_threshold:
+            return self._cache_entries[best][1]
+        return None
+
+    def _semantic_cache_store(self, query_vec: np.ndarray, prompt: str, response: str) -> None:
+        self._cache_vecs = np.vstack([self._cache_vecs, query_vec])
+        self._cache_entries.append((prompt, response))
+
+    def _save_semantic_cache(self) -> None:
+        if not self._cache_entries:
+            return
+        try:
+            np.savez(
+                self._cache_file,
+                vecs=self._cache_vecs,
+                prompts=np.array([prompt for prompt, _ in self._cache_entries]),
+                responses=np.array([response for _, response in self._cache_entries]),
+            )
+        except Exception as e:
+            self.error_log.append(f"Semantic cache save error: {e}")
+
+    async def _process_with_ai_async(self, user_input: str, query_vec: np.ndarray = None) -> None:
         self._update_footer("Processing with AI...", "cyan")
-        self._update_spinner_output("Processing...")
-        
+        self._update_output("Processing...", "AI Response")
+
         try:
             self.memory.append({"role": "user", "content": user_input})
-            completion = self.groq_client.chat.completions.create(
+            messages = [self._system_msg]
+            if self.memory_summary:
+                messages.append({"role": "system", "content": f"Summary of earlier conversation: {self.memory_summary}"})
+            completion = await self.groq_async.chat.completions.create(
                 model="llama-3.1-70b-versatile",
-                messages=[
-                    {"role": "system", "content": f"personality: {self.personality}"}] + self.memory,
+                messages=messages + self.memory,
                 temperature=1,
                 max_tokens=1024,
                 top_p=1,
+                seed=42,
                 stream=True,
                 stop=None,
             )
+            ws = await self._run_in_pool(self._open_tts_ws)
             ai_response = ""
-            for chunk in completion:
+            pending = ""
+            last_render = 0.0
+            async for chunk in completion:
                 if self.stop_requested:
                     break
-                ai_response += chunk.choices[0].delta.content or ""
+                delta = chunk.choices[0].delta.content or ""
+                ai_response += delta
+                if time.monotonic() - last_render > 0.1:
+                    self._update_output(ai_response, "AI Response (streaming)")
+                    last_render = time.monotonic()
+                if ws is not None:
+                    pending += delta
+                    pending = await self._run_in_pool(self._flush_sentences, pending, ws)
+            if ws is not None:
+                if pending.strip() and not self.stop_requested:
+                    await self._run_in_pool(self._speak_stream_ws, pending, ws)
+                await self._run_in_pool(self._speak_stream_ws, "", ws)
             if not self.stop_requested:
                 self.memory.append({"role": "assistant", "content": ai_response})
+                self._trim_memory()
+                if query_vec is not None and ai_response:
+                    self._semantic_cache_store(query_vec, user_input, ai_response)
                 self._update_output(ai_response, "AI Response")
-                self._speak_async(ai_response)
+                if ws is None:
+                    self._speak_async(ai_response)
         except Exception as e:
             self._update_footer(f"AI processing error: {e}", "red")
             self._echo_response(user_input)
@@ -155,18 +317,98 @@ class LiveSpeechRecognition:
             self.is_processing = False
             self.stop_requested = False
 
+    def _trim_memory(self) -> None:
+        if len(self.memory) <= self.memory_window:
+            return
+        overflow = self.memory[:-self.memory_window]
+        self.memory = self.memory[-self.memory_window:]
+        self._submit(self._summarize_memory, overflow)
+
+    def _summarize_memory(self, overflow: list) -> None:
+        try:
+            transcript = "\n".join(f"{message['role']}: {message['content']}" for message in overflow)
+            completion = self.groq_client.chat.completions.create(
+                model="llama-3.1-70b-versatile",
+                messages=[
+                    {"role": "system", "content": "Summarize this conversation excerpt in a few sentences, keeping any facts the assistant may need later."},
+                    {"role": "user", "content": transcript},
+                ],
+                temperature=0,
+                max_tokens=256,
+            )
+            summary = completion.choices[0].message.content or ""
+            self.memory_summary = f"{self.memory_summary} {summary}".strip()
+        except Exception as e:
+            self.error_log.append(f"Memory summarization error: {e}")
+
+    def _submit(self, fn, *args):
+        # Dispatch point for pool work submitted from outside the event loop.
+        return self.thread_pool.submit(fn, *args)
+
+    def _run_in_pool(self, fn, *args):
+        # Awaitable pool dispatch for coroutine code; run_in_executor bridges
+        # the executor future on the atomic-snapshot fast path (gh-134173)
+        # instead of copying state lock-by-lock.
+        return self._loop.run_in_executor(self.thread_pool, fn, *args)
+
     def _speak_async(self, text: str) -> None:
-        self.thread_pool.submit(self._speak, text)
+        self._submit(self._speak, text)
+
+    def _open_tts_ws(self):
+        try:
+            url = f"wss://api.elevenlabs.io/v1/text-to-speech/{self.voice_id}/stream-input?model_id=eleven_turbo_v2_5&output_format=pcm_22050&optimize_streaming_latency=3"
+            ws = create_connection(url, timeout=10)
+            ws.send(json.dumps({
+                "text": " ",
+                "voice_settings": {
+                    "stability": 0.5,
+                    "similarity_boost": 0.5
+                },
+                "xi_api_key": os.getenv("ELEVENLABS_API_KEY")
+            }))
+            self._submit(self._tts_ws_receiver, ws)
+            return ws
+        except Exception as e:
+            self.error_log.append(f"TTS websocket error: {e}")
+            return None
+
+    def _flush_sentences(self, pending: str, ws) -> str:
+        while True:
+            match = self._sentence_re.match(pending)
+            if not match:
+                return pending
+            sentence = match.group(0)
+            pending = pending[match.end():]
+            if sentence.strip():
+                self._speak_stream_ws(sentence, ws)
+
+    def _speak_stream_ws(self, text: str, ws) -> None:
+        try:
+            ws.send(json.dumps({"text": text}))
+        except Exception as e:
+            self.error_log.append(f"TTS websocket error: {e}")
+
+    def _tts_ws_receiver(self, ws) -> None:
+        def frames():
+            while True:
+                message = ws.recv()
+                if not message:
+                    break
+                payload = json.loads(message)
+                if payload.get("audio"):
+                    yield base64.b64decode(payload["audio"])
+                if payload.get("isFinal"):
+                    break
+        try:
+            self._play_pcm(frames())
+        except Exception as e:
+            self.error_log.append(f"TTS websocket error: {e}")
+        finally:
+            ws.close()
 
     def _speak(self, text: str) -> None:
         try:
-            url = "https://api.elevenlabs.io/v1/text-to-speech/vO7hjeAjmsdlGgUdvPpe" # Change this to whatever voice you want.
-            
-            headers = {
-                "Accept": "audio/mpeg",
-                "Content-Type": "application/json",
-                "xi-api-key": os.getenv("ELEVENLABS_API_KEY")
-            }
+            url = f"https://api.elevenlabs.io/v1/text-to-speech/{self.voice_id}/stream?optimize_streaming_latency=3&output_format=pcm_22050"
 
             data = {
                 "text": text,
@@ -177,45 +419,129 @@ class LiveSpeechRecognition:
                 }
             }
 
-            response = requests.post(url, json=data, headers=headers)
-            
-            if response.status_code == 200:
-                audio = AudioSegment.from_mp3(io.BytesIO(response.content))
-                play(audio)
-            else:
-                self.console.print(f"Error in speech synthesis: {response.status_code}", style="bold red")
-                self.error_log.append(f"Error in speech synthesis: {response.status_code}")
+            cache_path = self._tts_cache_path(data)
+            if os.path.exists(cache_path):
+                self._play_pcm_file(cache_path)
+                return
+
+            with self._http.stream("POST", url, json=data) as response:
+                if response.status_code == 200:
+                    self._play_pcm(self._tee_to_cache(response.iter_bytes(chunk_size=4096), cache_path))
+                else:
+                    self.console.print(f"Error in speech synthesis: {response.status_code}", style="bold red")
+                    self.error_log.append(f"Error in speech synthesis: {response.status_code}")
         except Exception as e:
             self.console.print(f"Error in speech synthesis: {e}", style="bold red")
             self.error_log.append(f"Error in speech synthesis: {e}")
         finally:
             self.is_processing = False
 
+    def _tts_cache_path(self, data: dict) -> str:
+        payload = {"voice_id": self.voice_id, "output_format": "pcm_22050", **data}
+        key = hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+        return os.path.join(self._tts_cache_dir, f"{key}.pcm")
+
+    def _tee_to_cache(self, chunks, cache_path: str):
+        os.makedirs(self._tts_cache_dir, exist_ok=True)
+        partial_path = f"{cache_path}.part"
+        completed = False
+        try:
+            with open(partial_path, "wb") as file:
+                for chunk in chunks:
+                    if chunk:
+                        file.write(chunk)
+                    yield chunk
+            completed = True
+        finally:
+            # The generator may be abandoned mid-stream (HTTP error, playback
+            # failure, shutdown); only a fully streamed file enters the cache.
+            if completed:
+                os.replace(partial_path, cache_path)
+                self._evict_tts_cache()
+            elif os.path.exists(partial_path):
+                os.remove(partial_path)
+
+    def _play_pcm_file(self, path: str) -> None:
+        def chunks():
+            with open(path, "rb") as file:
+                while chunk := file.read(4096):
+                    yield chunk
+        self._play_pcm(chunks())
+
+    def _evict_tts_cache(self) -> None:
+        paths = [
+            os.path.join(self._tts_cache_dir, name)
+            for name in os.listdir(self._tts_cache_dir)
+            if name.endswith((".pcm", ".pcm.part"))
+        ]
+        total = sum(os.path.getsize(path) for path in paths)
+        if total <= self._tts_cache_limit:
+            return
+        for path in sorted(paths, key=os.path.getatime):
+            total -= os.path.getsize(path)
+            os.remove(path)
+            if total <= self._tts_cache_limit:
+                break
+
+    def _play_pcm(self, chunks) -> None:
+        remainder = b""
+        with self._playback_lock:
+            if self._playback_closed:
+                return
+            stream = self._get_playback_stream()
+            for chunk in chunks:
+                if self._playback_closed:
+                    break
+                if not chunk:
+                    continue
+                buffer = remainder + chunk
+                # int16 frames are 2 bytes; carry any odd trailing byte into the next write.
+                cut = len(buffer) - (len(buffer) % 2)
+                if cut:
+                    stream.write(buffer[:cut])
+                remainder = buffer[cut:]
+
+    def _get_playback_stream(self) -> sd.RawOutputStream:
+        # Opened once and kept running so each utterance skips device setup.
+        if self._playback_stream is None:
+            self._playback_stream = sd.RawOutputStream(samplerate=22050, channels=1, dtype="int16")
+            self._playback_stream.start()
+        return self._playback_stream
+
     def _echo_response(self, user_input: str) -> None:
         self._update_output(f"Echo: {user_input}", "Echo Response")
 
     def _update_footer(self, message: str, style: str = "blue") -> None:
-        self.layout["footer"].update(Panel(message, style=f"bold {style}"))
+        panel = self._footer_panels.get(style)
+        if panel is None:
+            panel = self._footer_panels.setdefault(style, Panel(self._footer_text, style=f"bold {style}"))
+        self._footer_text.plain = message
+        self.layout["footer"].update(panel)
+        self._refresh()
 
     def _update_input(self, message: str) -> None:
-        self.layout["input"].update(Panel(Text(message, style="green"), title="Input"))
+        self._input_text.plain = message
+        self._refresh()
 
     def _update_output(self, message: str, title: str) -> None:
-        self.layout["output"].update(Panel(Text(message, style="cyan"), title=title))
+        self._output_text.plain = message
+        self._output_panel.title = title
+        self._refresh()
 
-    def _update_spinner_output(self, title: str) -> None:
-        self.layout["output"].update(Panel(Spinner("dots"), title=title))
+    def _refresh(self) -> None:
+        if self._live is not None:
+            self._live.refresh()
 
     def save_transcription_history(self, file_path: str) -> None:
         with open(file_path, 'w') as file:
-            for line in self.transcription_history:
-                file.write(f"{line}\n")
+            if self.transcription_history:
+                file.write("\n".join(self.transcription_history) + "\n")
         self.console.print(f"Transcription history saved to {file_path}", style="bold green")
 
     def save_error_log(self, file_path: str) -> None:
         with open(file_path, 'w') as file:
-            for error in self.error_log:
-                file.write(f"{error}\n")
+            if self.error_log:
+                file.write("\n".join(str(error) for error in self.error_log) + "\n")
         self.console.print(f"Error log saved to {file_path}", style="bold red")
 
 if __name__ == "__main__":